@@ -26,7 +26,8 @@ setup(
     author='Shaheed Haque',
     author_email='srhaque@theiet.org',
     description='Curses UI for a combination of tmux/screen and SSH (with multiple jump hosts)',
-    long_description=open('README.rst').read(),
+    long_description=open('README.rst', encoding='utf-8').read(),
+    long_description_content_type='text/x-rst',
     classifiers=["Topic :: Terminals :: Terminal Emulators/X Terminals",
                  "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
                  "Development Status :: 5 - Production/Stable",
@@ -34,5 +35,8 @@ setup(
     entry_points = {
         'console_scripts': ['svty=svty.svty:main'],
     },
-    install_requires=['setproctitle', 'pydevd']
+    install_requires=['setproctitle'],
+    extras_require={
+        'debug': ['pydevd'],
+    }
 )
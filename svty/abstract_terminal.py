@@ -15,15 +15,27 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 """Abstract models of Terminals, Sessions and Windows."""
+import gettext
+import logging
+import os
 import threading
+import time
 from abc import ABCMeta, abstractmethod
 
 
-class AbstractWindow(dict):
+gettext.install(os.path.basename(__file__))
+logger = logging.getLogger(__name__)
+
+# Keep PyCharm happy.
+_ = _
+
+
+class AbstractWindow(dict, metaclass=ABCMeta):
     """
-    Model of a screen window, a subset of tmux's model.
+    Model of a screen window, a subset of tmux's model. The properties of the window are held as dictionary items, so
+    the only attribute is the manager, and there is no per-instance __dict__.
     """
-    __metaclass__ = ABCMeta
+    __slots__ = ("manager",)
 
     def __init__(self, manager):
         super(AbstractWindow, self).__init__()
@@ -36,18 +48,16 @@ class AbstractWindow(dict):
 
         Returns: The string key.
         """
-        raise NotImplementedError()
 
     @abstractmethod
     def list_panes(self):
         """
-        :return: A list of the Panes in the AbstractWindow.
+        :return: A tuple of the Panes in the AbstractWindow.
         """
-        raise NotImplementedError()
 
 
-class AbstractSession(dict):
-    __metaclass__ = ABCMeta
+class AbstractSession(dict, metaclass=ABCMeta):
+    __slots__ = ("manager",)
 
     def __init__(self, manager):
         super(AbstractSession, self).__init__()
@@ -60,21 +70,18 @@ class AbstractSession(dict):
 
         Returns: The string key.
         """
-        raise NotImplementedError()
 
     @abstractmethod
     def check_output(self, args):
         """
         Run a command on the session.
         """
-        raise NotImplementedError()
 
     @abstractmethod
     def list_windows(self):
         """
-        :return: A list of the Windows in the session.
+        :return: A tuple of the Windows in the session.
         """
-        raise NotImplementedError()
 
     @abstractmethod
     def capture(self):
@@ -84,7 +91,6 @@ class AbstractSession(dict):
         :return: A tuple (screen capture for current window, status line). Each of these lines is padded to the width
                  of the window, and the screen capture contains the same number of lines as the window.
         """
-        raise NotImplementedError()
 
     @abstractmethod
     def attach(self):
@@ -94,36 +100,93 @@ class AbstractSession(dict):
 
         (Re-)attach to the session.
         """
-        raise NotImplementedError()
 
 
-class AbstractExecutor(threading.Thread):
+class AbstractExecutor(threading.Thread, metaclass=ABCMeta):
+    """
+    Execution context for terminal programs, either local or remote. Every query made by a terminal goes through
+    check_output(), so a remote implementation should keep one connection open and multiplex commands over it, rather
+    than paying for a new connection (and SSH handshake) per command.
+    """
     def __init__(self):
         super(AbstractExecutor, self).__init__(name=self.__class__.__name__)
 
     @abstractmethod
     def exec(self, args, quote=True):
-        raise NotImplementedError()
+        """
+        Run an interactive command, connected to the user's terminal.
+
+        :param args:            The command.
+        :param quote:           Should the arguments be quoted for the shell?
+        :return:                The return status of the command.
+        """
+
+    @abstractmethod
+    def check_output(self, args, ignore_errors=None):
+        """
+        Run a command and capture its output, with stderr merged into stdout.
+
+        :param args:            The command.
+        :param ignore_errors:   Optional callable(stdout, returncode) which returns True for errors to be ignored.
+        :return:                The output of the command.
+        :raises: subprocess.CalledProcessError if the command fails, and the error is not ignored.
+        """
 
     @abstractmethod
     def close(self):
-        raise NotImplementedError()
+        """
+        Stop the executor, and any connection it holds open.
+        """
 
 
-class AbstractTerminal(object):
+class AbstractTerminal(object, metaclass=ABCMeta):
     """
     Model a verb used to implement terminal sessions.
     """
-    __metaclass__ = ABCMeta
+
+    """
+    Listing sessions, windows or panes means running the terminal program (possibly on the far side of an SSH
+    connection). Results are reused for this many seconds so that successive redraws do not keep doing that.
+    """
+    CACHE_TTL = 0.5
+    """
+    The list of sessions changes far less often than their content, and is needed every time the home screen is drawn.
+    Our own changes (new_session(), attach()) invalidate it anyway.
+    """
+    SESSIONS_TTL = 2.0
+    """
+    Once the list of sessions has expired, it is still returned, while a background thread refreshes it, for this many
+    seconds. The home screen can therefore be redrawn (e.g. on key repeat or resize) without waiting on the terminal
+    program.
+    """
+    SESSIONS_STALE_TTL = 10.0
 
     def __init__(self, program: str, remote: AbstractExecutor) -> None:
         super(AbstractTerminal, self).__init__()
         self.program = program
-        self.exec = remote
+        self.executor = remote
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._cache_generation = 0
+        self._refreshing = {}
+        #
+        # The queries which may be refreshed in the background, and their TTLs, by key.
+        #
+        self._refreshable = {}
+        #
+        # Counts the background refreshes which have stored a new result.
+        #
+        self.refreshes = 0
 
     @abstractmethod
     def check_output(self, args: list, safe_msgs: tuple = ()) -> str:
-        raise NotImplementedError()
+        """
+        Run a command of the terminal program, and capture its output.
+
+        :param args:            The arguments to the terminal program.
+        :param safe_msgs:       Output prefixes which mean that an error exit status can be ignored.
+        :return:                The output of the command.
+        """
 
     def call(self, args: list) -> int:
         """
@@ -132,16 +195,130 @@ class AbstractTerminal(object):
         :param args:            The command
         :return:                The return status of the command.
         """
-        cmd = [self.program] + args
-        return self.exec.exec(cmd)
+        return self.executor.exec([self.program, *args])
+
+    def cached(self, key: tuple, query, ttl: float = None, stale_ttl: float = None):
+        """
+        Run a query, or reuse its result if it was run recently enough.
+
+        :param key:             Identifies the query, e.g. ("list-windows", session_id).
+        :param query:           Callable which runs the query.
+        :param ttl:             How long a result may be reused, CACHE_TTL by default.
+        :param stale_ttl:       If given, an expired result younger than this is still returned, and the query is rerun
+                                in the background.
+        :return:                The result of the query.
+        :raises: FileNotFoundError from the query, which is cached like a result.
+        """
+        if ttl is None:
+            ttl = self.CACHE_TTL
+        now = time.monotonic()
+        if stale_ttl is not None:
+            self._refreshable[key] = (query, ttl)
+        try:
+            timestamp, result, error = self._cache[key]
+        except KeyError:
+            pass
+        else:
+            age = now - timestamp
+            if age < ttl or (stale_ttl is not None and age < stale_ttl):
+                if age >= ttl:
+                    self._revalidate(key, query)
+                if error:
+                    raise error.with_traceback(None)
+                return result
+        result, error = self._query(query)
+        self._cache[key] = (now, result, error)
+        if error:
+            raise error
+        return result
+
+    @staticmethod
+    def _query(query):
+        """
+        Run a query, catching the errors which are worth caching, such as a missing terminal program. Otherwise, every
+        use would rerun the query only to fail again.
+
+        :param query:           Callable which runs the query.
+        :return:                A tuple (result, error).
+        """
+        try:
+            return query(), None
+        except FileNotFoundError as e:
+            return None, e
+
+    def _revalidate(self, key: tuple, query) -> None:
+        """
+        Rerun a query in a background thread, unless that is already happening.
+
+        :param key:             Identifies the query.
+        :param query:           Callable which runs the query.
+        """
+        def refresh():
+            try:
+                now = time.monotonic()
+                result, error = self._query(query)
+                with self._cache_lock:
+                    #
+                    # Do not resurrect a result from before an invalidate().
+                    #
+                    if generation == self._cache_generation:
+                        self._cache[key] = (now, result, error)
+                        self.refreshes += 1
+            except Exception as e:
+                #
+                # Leave the stale result in place. Once it is too old, the next query runs in the foreground, and
+                # any error is raised there.
+                #
+                logger.debug(_("Refresh of {} failed: {}").format(key, e))
+            finally:
+                with self._cache_lock:
+                    del self._refreshing[key]
+
+        with self._cache_lock:
+            if key in self._refreshing:
+                return
+            generation = self._cache_generation
+            thread = threading.Thread(target=refresh, name="refresh", daemon=True)
+            self._refreshing[key] = thread
+            thread.start()
+
+    def refresh(self) -> None:
+        """
+        Start background refreshes of any expired results which allow it, without waiting for them. Progress can be
+        followed using the refreshes count.
+        """
+        now = time.monotonic()
+        for key, (query, ttl) in list(self._refreshable.items()):
+            entry = self._cache.get(key)
+            if entry is not None and now - entry[0] >= ttl:
+                self._revalidate(key, query)
+
+    def wait_for_refreshes(self) -> None:
+        """
+        Wait for any background queries to finish. They must not still be using the execution context when, for
+        example, it is handed over to the user's session.
+        """
+        with self._cache_lock:
+            threads = list(self._refreshing.values())
+        for thread in threads:
+            thread.join()
+
+    def invalidate(self) -> None:
+        """
+        Forget any cached query results, typically because sessions are being created or attached. Any background
+        queries are waited for.
+        """
+        with self._cache_lock:
+            self._cache_generation += 1
+            self._cache.clear()
+        self.wait_for_refreshes()
 
     @abstractmethod
-    def list_sessions(self) -> AbstractSession:
+    def list_sessions(self) -> tuple:
         """
-        :return: List of AbstractSession.
+        :return: A tuple of AbstractSession.
         :raises: FileNotFoundError if the relevant program is not found.
         """
-        raise NotImplementedError()
 
     @abstractmethod
     def new_session(self) -> None:
@@ -150,7 +327,6 @@ class AbstractTerminal(object):
 
         :raises: FileNotFoundError if the relevant program is not found.
         """
-        raise NotImplementedError()
 
     def close(self) -> None:
         """
@@ -158,4 +334,4 @@ class AbstractTerminal(object):
         a thread and then this method used to close the sessions they use. NOTE: calling this method is the last
         operation that can be performed on an instance of this class.
         """
-        self.exec.close()
+        self.executor.close()
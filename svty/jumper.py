@@ -20,15 +20,18 @@
 """Use SSH to connect to a host, possibly jumping through multiple intermediaries."""
 from __future__ import print_function
 import argparse
+import concurrent.futures
 import errno
 import fcntl
 import gettext
 import inspect
+import ipaddress
 import logging
 import os
 import pty
 import re
 import select
+import selectors
 import setproctitle
 import shlex
 import signal
@@ -39,7 +42,6 @@ import sys
 import tempfile
 import termios
 import threading
-import time
 import tty
 
 
@@ -71,6 +73,21 @@ class SSHMultiPass(threading.Thread):
     """
 
     PROMPT = b"'s password: "
+    """
+    How much output is kept while looking for a PROMPT. This must cover the longest "user@host" which precedes it, plus
+    the PROMPT itself, in case either is split across reads.
+    """
+    PROMPT_HISTORY = 512
+    """
+    Read size for relaying data. Each read costs a system call whatever its size, so use the largest amount a pty or
+    pipe is likely to have buffered.
+    """
+    READ_CHUNK = 65536
+    """
+    The most reads of the child's output to batch into one write to the parent, so that a flood of output cannot
+    starve the input.
+    """
+    READ_BATCH = 16
 
     """
     An invocation of call() can be a simple one where the login process is handled, and then the returned value is
@@ -90,6 +107,10 @@ class SSHMultiPass(threading.Thread):
     or a follow_on(FOLLOW_ON_PIO).
     """
     FOLLOW_ON_HCI = "human_computer_interaction"
+    """
+    Escape backslashes and double quotes in a nested ProxyCommand, in one pass.
+    """
+    PROXY_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"'})
 
     def __init__(self, passwords, add_cr=False):
         """
@@ -101,19 +122,38 @@ class SSHMultiPass(threading.Thread):
         :param add_cr:          We use raw mode TTYs. Convert LF into CR-LF?
         """
         super(SSHMultiPass, self).__init__(name=self.__class__.__name__)
-        self.prompt_buffer = b""
         self.passwords = {k.encode(): v.encode() for k, v in passwords.items()}
-        self.allpasswords = list(self.passwords.keys())
+        self.prompt_buffer = bytearray() if self.passwords else None
+        self._given_passwords = passwords
         self.add_cr = add_cr
         self.is_a_tty = None
         self.old_tty = None
         self.old_sigwinch = None
         self.stdin = None
         self.stdout = None
+        self.stdin_fd = None
+        self.stdout_fd = None
         self.pid = None
         self.master_fd = None
         self._follow_on = None
         self.stopping = False
+        self._selector = None
+        #
+        # The I/O loops block until there is something to do. This event (when idle in programmed IO) and "self-pipe"
+        # (when in select()) let other threads wake them up.
+        #
+        self._state_change = threading.Event()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+
+    @property
+    def allpasswords(self):
+        """
+        The "user@host" keys of all the passwords we were given, including any already used. Only needed for error
+        reporting, so built on demand.
+        """
+        return [k.encode() for k in self._given_passwords]
 
     def output(self, argv, stdin=sys.stdin):
         """
@@ -128,23 +168,20 @@ class SSHMultiPass(threading.Thread):
         :param stdin:           The source of input.
         :return:                String stdout.
         """
-        output = ""
         self._follow_on = SSHMultiPass.FOLLOW_ON_NONE
         try:
-            with tempfile.TemporaryFile(mode="rw+U") as f:
+            with tempfile.TemporaryFile() as f:
                 self._spawn(argv, stdin, stdout=f)
-                f.flush()
                 f.seek(0)
-                #
-                # Omit lines asking for passwords...
-                #
-                for line in f:
-                    if line[:-1].endswith(SSHMultiPass.PROMPT):
-                        continue
-                    output += line
+                lines = f.read().split(b"\n")
             self.wait()
         finally:
             self.close()
+        #
+        # Omit lines asking for passwords. The TTY turns the newline after each one into CR-LF.
+        #
+        output = b"\n".join([line for line in lines if not line.rstrip(b"\r").endswith(SSHMultiPass.PROMPT)])
+        output = output.decode()
         return output
 
     def call(self, argv, follow_on, stdin=sys.stdin):
@@ -189,20 +226,40 @@ class SSHMultiPass(threading.Thread):
         :param stdout:          A file-like object.
         """
         if isinstance(stdin, list):
-            with tempfile.TemporaryFile(mode="rw+U") as f:
-                for line in stdin:
-                    f.write(line)
-                    if line[-1] != "\n":
-                        f.write("\n")
-                f.flush()
-                f.seek(0)
+            #
+            # Feed the lines through a pipe. A thread does the writing so that we cannot deadlock on a full pipe.
+            #
+            r, w = os.pipe()
+            writer = threading.Thread(target=self._write_lines, args=(w, stdin), name="SSHMultiPassStdin", daemon=True)
+            writer.start()
+            with open(r, mode="rb", buffering=0) as f:
                 self._spawn_with_files(argv, f, stdout)
         elif isinstance(stdin, str):
-            with open(stdin, mode="rU") as f:
+            with open(stdin, mode="rb", buffering=0) as f:
                 self._spawn_with_files(argv, f, stdout)
         else:
             self._spawn_with_files(argv, stdin, stdout)
 
+    @staticmethod
+    def _write_lines(fd, lines):
+        """
+        Write lines, each terminated by a newline, to a file descriptor and close it.
+
+        :param fd:              The file descriptor.
+        :param lines:           An array of strings.
+        """
+        try:
+            with open(fd, mode="w") as f:
+                for line in lines:
+                    f.write(line)
+                    if not line.endswith("\n"):
+                        f.write("\n")
+        except BrokenPipeError:
+            #
+            # The reader has finished.
+            #
+            pass
+
     def _spawn_with_files(self, argv, stdin, stdout):
         """
         Main loop. The caller should use the wait() method to tidyup.
@@ -212,6 +269,8 @@ class SSHMultiPass(threading.Thread):
         """
         self.stdin = stdin
         self.stdout = stdout
+        self.stdin_fd = stdin.fileno()
+        self.stdout_fd = stdout.fileno()
         self.pid, self.master_fd = pty.fork()
         if self.pid == pty.CHILD:
             os.execlp(argv[0], *argv)
@@ -219,7 +278,7 @@ class SSHMultiPass(threading.Thread):
             # Well, we are the child, but make the code look sane.
             #
             return
-        self.is_a_tty = os.isatty(self.stdin.fileno())
+        self.is_a_tty = os.isatty(self.stdin_fd)
         if self.is_a_tty:
             #
             # Initialise and track the window size.
@@ -231,107 +290,205 @@ class SSHMultiPass(threading.Thread):
             # Pass all characters including ^C to the remote end.
             #
             tty.setraw(self.stdin)
+        #
+        # Allow the relay to drain whatever the child has written without blocking. Note that stdin is left alone,
+        # since it is typically shared with our parent.
+        #
+        os.set_blocking(self.master_fd, False)
+        self._selector = self._new_selector()
         try:
-            readable = False
-            while self.passwords or self._follow_on == SSHMultiPass.FOLLOW_ON_NONE:
-                try:
-                    r, w, e = select.select([self.master_fd, self.stdin], [], [], 0.1)
-                except OSError as e:
-                    if e.errno != errno.EINTR:
-                        raise e
-                    continue
-                if self.master_fd in r:
-                    if not self.passwords:
-                        readable = True
-                    #
-                    # Forward to user.
-                    #
-                    try:
-                        data = os.read(self.master_fd, 1024)
-                    except OSError as e:
-                        if e.errno == errno.EIO:
-                            logger.debug(_("Proxied child transport closed"))
-                            break
-                        else:
-                            raise
-                    self._write_parent(data)
-                if self.stdin in r:
-                    #
-                    # Don't mix scripted input and passwords.
-                    #
-                    if not readable:
-                        continue
-                    #
-                    # Forward to child.
-                    #
-                    data = os.read(self.stdin.fileno(), 1024)
-                    if len(data) == 0:
-                        logger.debug(_("Stdin closed"))
-                        break
-                    self._write_child(data)
+            self._io_loop(login=True)
         finally:
             #
-            # In ping-pong mode, defer the tidyup else do it now.
+            # Human-computer interaction continues in our thread. Programmed IO needs no thread unless and until it is
+            # followed by human-computer interaction. Otherwise, tidyup now.
             #
-            if self._follow_on != SSHMultiPass.FOLLOW_ON_NONE:
+            if self._follow_on == SSHMultiPass.FOLLOW_ON_HCI:
                 self.start()
-            else:
-                self.run()
+            elif self._follow_on == SSHMultiPass.FOLLOW_ON_NONE:
+                self._tidyup()
+
+    def _io_loop(self, login):
+        """
+        Relay I/O between the child and the parent.
+
+        :param login:           During login, relay until all passwords are sent (or, with FOLLOW_ON_NONE, until the
+                                end). Otherwise, relay for as long as FOLLOW_ON_HCI is in effect.
+        :return:                False if either side has closed, else True.
+        """
+        readable = not login
+        while not self.stopping:
+            if login:
+                if not self.passwords and self._follow_on != SSHMultiPass.FOLLOW_ON_NONE:
+                    break
+            elif self._follow_on != SSHMultiPass.FOLLOW_ON_HCI:
+                break
+            ready = self._select()
+            if self._wake_r in ready:
+                #
+                # Go round to look at self.stopping and self._follow_on.
+                #
+                self._drain_wake()
+                continue
+            if self.master_fd in ready and not self.passwords:
+                readable = True
+            #
+            # Don't mix scripted input and passwords.
+            #
+            if not self._relay(ready, readable):
+                return False
+        return True
 
     def run(self):
         try:
-            while not self.stopping and self._follow_on != SSHMultiPass.FOLLOW_ON_NONE:
-                while not self.stopping and self._follow_on == SSHMultiPass.FOLLOW_ON_PIO:
-                    time.sleep(0.1)
-
-                while not self.stopping and self._follow_on == SSHMultiPass.FOLLOW_ON_HCI:
-                    try:
-                        r, w, e = select.select([self.master_fd, self.stdin], [], [], 0.1)
-                    except OSError as e:
-                        if e.errno != errno.EINTR:
-                            raise e
-                        continue
-                    if self.master_fd in r:
-                        #
-                        # Forward to user.
-                        #
-                        try:
-                            data = os.read(self.master_fd, 1024)
-                        except OSError as e:
-                            if e.errno == errno.EIO:
-                                logger.debug(_("Proxied child transport closed"))
-                                break
-                            else:
-                                raise
-                        self._write_parent(data)
-                    if self.stdin in r:
-                        #
-                        # Forward to child.
-                        #
-                        data = os.read(self.stdin.fileno(), 1024)
-                        if len(data) == 0:
-                            logger.debug(_("Stdin closed"))
-                            break
-                        self._write_child(data)
+            closed = False
+            while not self.stopping:
+                if self._follow_on == SSHMultiPass.FOLLOW_ON_HCI and not closed:
+                    closed = not self._io_loop(login=False)
+                else:
+                    #
+                    # Wait for close(), or a follow_on() to FOLLOW_ON_HCI.
+                    #
+                    self._state_change.wait()
+                    self._state_change.clear()
         finally:
-            logger.debug(_("Stopping {}").format(self))
-            if self.is_a_tty:
-                tty.tcsetattr(self.stdin, tty.TCSAFLUSH, self.old_tty)
+            self._tidyup()
+
+    def _tidyup(self):
+        """
+        Restore the TTY, and release our resources.
+        """
+        if self._selector is None:
+            return
+        logger.debug(_("Stopping {}").format(self))
+        if self.is_a_tty:
+            tty.tcsetattr(self.stdin, tty.TCSAFLUSH, self.old_tty)
+            try:
+                signal.signal(signal.SIGWINCH, self.old_sigwinch)
+            except ValueError:
+                #
+                # ValueError: signal only works in main thread. See self.close().
+                #
+                pass
+        self._selector.close()
+        self._selector = None
+        os.close(self.master_fd)
+        os.close(self._wake_r)
+
+    def _new_selector(self):
+        """
+        Create the selector used by the I/O loops, with the child, stdin and wakeup descriptors registered once.
+        """
+        selector = selectors.DefaultSelector()
+        try:
+            selector.register(self.stdin_fd, selectors.EVENT_READ)
+        except PermissionError:
+            #
+            # epoll(7) refuses regular files, such as the scripted input used by output(). Those are always readable
+            # anyway, so select(2) does just as well.
+            #
+            selector.close()
+            selector = selectors.SelectSelector()
+            selector.register(self.stdin_fd, selectors.EVENT_READ)
+        selector.register(self.master_fd, selectors.EVENT_READ)
+        selector.register(self._wake_r, selectors.EVENT_READ)
+        return selector
+
+    def _select(self):
+        """
+        Wait for input.
+
+        :return:                The set of readable descriptors.
+        """
+        return {key.fd for key, events in self._selector.select()}
+
+    def _relay(self, ready, forward_stdin):
+        """
+        Relay output from the child to the parent, and input from the parent to the child.
+
+        :param ready:           The set of readable descriptors.
+        :param forward_stdin:   Should input be forwarded to the child?
+        :return:                False if either side has closed, else True.
+        """
+        if self.master_fd in ready:
+            #
+            # Forward to user, batching whatever is already available into one write.
+            #
+            chunks = []
+            closed = False
+            while len(chunks) < SSHMultiPass.READ_BATCH:
                 try:
-                    signal.signal(signal.SIGWINCH, self.old_sigwinch)
-                except ValueError:
+                    data = os.read(self.master_fd, SSHMultiPass.READ_CHUNK)
+                except BlockingIOError:
+                    break
+                except OSError as e:
+                    if e.errno == errno.EIO:
+                        closed = True
+                        break
+                    else:
+                        raise
+                chunks.append(data)
+                if len(data) < SSHMultiPass.READ_CHUNK:
                     #
-                    # ValueError: signal only works in main thread. See self.close().
+                    # A short read means there is nothing more for now.
                     #
-                    pass
-            os.close(self.master_fd)
+                    break
+            if chunks:
+                self._write_parent(b"".join(chunks))
+            if closed:
+                logger.debug(_("Proxied child transport closed"))
+                return False
+        if forward_stdin and self.stdin_fd in ready:
+            #
+            # Forward to child.
+            #
+            data = os.read(self.stdin_fd, SSHMultiPass.READ_CHUNK)
+            if len(data) == 0:
+                logger.debug(_("Stdin closed"))
+                return False
+            self._write_child(data)
+        return True
 
     def close(self):
         logger.debug(_("Signalling stop for {}").format(self))
         self.stopping = True
+        self._wake()
+        if self.ident is None:
+            #
+            # There is no thread to tidyup.
+            #
+            self._tidyup()
+        if self._wake_w is not None:
+            os.close(self._wake_w)
+            self._wake_w = None
         if self.old_sigwinch:
             signal.signal(signal.SIGWINCH, self.old_sigwinch)
 
+    def _wake(self):
+        """
+        Wake up any I/O loop blocked in select(), or idle in programmed IO, so that it notices a change of state.
+        """
+        self._state_change.set()
+        if self._wake_w is None:
+            return
+        try:
+            os.write(self._wake_w, b"\0")
+        except (BlockingIOError, BrokenPipeError):
+            #
+            # Either a wakeup is already pending, or the loop has already finished.
+            #
+            pass
+
+    def _drain_wake(self):
+        """
+        Consume pending wakeups.
+        """
+        try:
+            while os.read(self._wake_r, 1024):
+                pass
+        except BlockingIOError:
+            pass
+
     def wait(self):
         #
         # What happened?
@@ -352,13 +509,21 @@ class SSHMultiPass(threading.Thread):
         """
         self._write_child(data)
 
-    def pong(self, size):
+    def pong(self, size, timeout=None):
         """
         Read from remote end of SSH connection. See FOLLOW_ON_PIO for details.
 
-        :return:                    Upto size bytes read.
+        :param size:                The most bytes to read.
+        :param timeout:             The most seconds to wait for data, or None to wait as long as needed.
+        :return:                    Upto size bytes read, or b"" on timeout.
         """
-        return os.read(self.master_fd, size)
+        while True:
+            try:
+                return os.read(self.master_fd, size)
+            except BlockingIOError:
+                r, w, e = select.select([self.master_fd], [], [], timeout)
+                if not r:
+                    return b""
 
     def follow_on(self, value):
         """
@@ -370,6 +535,9 @@ class SSHMultiPass(threading.Thread):
         assert value in follow_ons, _("{} must be one of {}").format(value, follow_ons)
         logger.debug(_("Setting follow_on to {}").format(value))
         self._follow_on = value
+        if value == SSHMultiPass.FOLLOW_ON_HCI and self.ident is None:
+            self.start()
+        self._wake()
         #
         # TODO: Return the last useful status?
         #
@@ -380,9 +548,13 @@ class SSHMultiPass(threading.Thread):
         """
         Write to the child process.
         """
+        data = memoryview(data)
         n = 0
         while n < len(data):
-            n += os.write(self.master_fd, data[n:])
+            try:
+                n += os.write(self.master_fd, data[n:])
+            except BlockingIOError:
+                select.select([], [self.master_fd], [])
 
     def _write_parent(self, data):
         """
@@ -390,9 +562,10 @@ class SSHMultiPass(threading.Thread):
         """
         if self.add_cr:
             data = data.replace("\n", "\r\n")
+        view = memoryview(data)
         n = 0
-        while n < len(data):
-            n += os.write(self.stdout.fileno(), data[n:])
+        while n < len(view):
+            n += os.write(self.stdout_fd, view[n:])
         #
         # Respond to any inbound password prompts. We use a history buffer
         # during initial processing to ensure we match across read buffer
@@ -400,15 +573,19 @@ class SSHMultiPass(threading.Thread):
         # this; this avoid growing the buffer indefinitely and also speeds
         # things up.
         #
-        if self.passwords:
-            self.prompt_buffer += data
+        if self.prompt_buffer is not None:
+            prompt = SSHMultiPass.PROMPT
+            #
+            # The history was already searched, so only a PROMPT which straddles the new data can be found in it.
+            #
+            scan_from = max(0, len(self.prompt_buffer) - len(prompt) + 1)
+            self.prompt_buffer.extend(data)
             while True:
-                prompt = SSHMultiPass.PROMPT
-                iprompt = self.prompt_buffer.find(prompt)
+                iprompt = self.prompt_buffer.find(prompt, scan_from)
                 if iprompt == -1:
                     break
                 iuser_host = self.prompt_buffer.rfind(b"\n", 0, iprompt)
-                user_host = self.prompt_buffer[iuser_host + 1:iprompt]
+                user_host = bytes(memoryview(self.prompt_buffer)[iuser_host + 1:iprompt])
                 #
                 # Send this password.
                 #
@@ -418,11 +595,23 @@ class SSHMultiPass(threading.Thread):
                 except KeyError:
                     raise RuntimeError(_("No password for {} ({})").format(user_host, self.allpasswords))
                 self._write_child(password + b"\n")
+                if not self.passwords:
+                    #
+                    # That was the last one, so free the history.
+                    #
+                    self.prompt_buffer = None
+                    return
                 #
                 # Trim the buffer and go around in case we have any more
                 # passwords in this buffer.
                 #
-                self.prompt_buffer = self.prompt_buffer[iprompt + len(prompt):]
+                del self.prompt_buffer[:iprompt + len(prompt)]
+                scan_from = 0
+            #
+            # Anything older than PROMPT_HISTORY cannot be part of a prompt.
+            #
+            if len(self.prompt_buffer) > SSHMultiPass.PROMPT_HISTORY:
+                del self.prompt_buffer[:-SSHMultiPass.PROMPT_HISTORY]
 
     @staticmethod
     def get_proxies(uphps, options):
@@ -434,8 +623,7 @@ class SSHMultiPass(threading.Thread):
             via_username, via_password, via_host, via_port = uphps[i]
             to_username, to_password, to_host, to_port = uphps[i + 1]
             if proxy:
-                proxy = proxy.replace('\\', '\\\\')
-                proxy = proxy.replace('"', '\\"')
+                proxy = proxy.translate(SSHMultiPass.PROXY_ESCAPES)
             #
             # We cannot use the -W %h:%p form for multiple hops...
             # The new -J option does not support passing options to these proxying steps.
@@ -493,62 +681,119 @@ class SSHMultiPass(threading.Thread):
         return wrapper, remote, passwords
 
 
+#
+# Entries are separated by "+", but "++" is an escaped "+" in a password.
+#
+_UPHP_SPLITTER = re.compile(r"\+(?!\+)")
+#
+# The common forms of User[:Password]@Host[:Port]. Anything else, such as a key file or a malformed port, is left to
+# _split_uphp().
+#
+_UPHP = re.compile(r"(?:(?P<user>[^:@=]*)(?::(?P<password>.*))?@)?(?P<host>[^:@]+)(?::(?P<port>[0-9]+))?")
+
+
+def _split_uphp(uphp: str) -> tuple:
+    """
+    Split one User[:Password]@Host[:Port] entry, without any validation of the host or port.
+
+    :return: A tuple of (user, password, host, port) strings.
+    """
+    try:
+        up, hp = uphp.rsplit("@", 1)
+    except ValueError:
+        #
+        # Expected exactly one '@'.
+        #
+        up = os.environ["USER"]
+        hp = uphp
+    #
+    # Default password is "".
+    #
+    up = up.split(":", 1)
+    if len(up) > 1:
+        user = up[0]
+        #
+        # Unescape passwords.
+        #
+        password = "p:" + up[1].replace("++", "+")
+    elif up[0].find("=") > -1:
+        up = up[0].split("=", 1)
+        user = up[0]
+        password = "k:" + up[1]
+    else:
+        user = up[0]
+        password = "p:"
+    #
+    # Default port is 22.
+    #
+    hp = hp.split(":", 1) + ["22"]
+    return user, password[2:], hp[0], hp[1]
+
+
+def _gethostbyname(host: str) -> str:
+    """
+    Look up the address of a host.
+
+    :return: The address, or None if it cannot be found.
+    """
+    try:
+        return socket.gethostbyname(host)
+    except:
+        return None
+
+
+def _is_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
 def parse_uphps(encoded_uphps: str) -> list:
     """
     Decode a list of User[:Password]@Host[:Port] entries, separated by "+".
 
     :return: A list of (user, password, host, port).
     """
-    #
-    # Split/canonicalise User[:Password]@Host[:Port].
-    #
-    uphp_splitter = re.compile(r"\+(?!\+)")
-    uphps = []
+    entries = []
     try:
-        for uphp in uphp_splitter.split(encoded_uphps):
+        for uphp in _UPHP_SPLITTER.split(encoded_uphps):
             logger.debug(_("Parsing {}").format(uphp))
-            try:
-                up, hp = uphp.rsplit("@", 1)
-            except ValueError:
-                #
-                # Expected exactly one '@'.
-                #
-                up = os.environ["USER"]
-                hp = uphp
             #
-            # Default password is "".
+            # Split/canonicalise User[:Password]@Host[:Port].
             #
-            up = up.split(":", 1)
-            if len(up) > 1:
-                user = up[0]
-                #
-                # Unescape passwords.
-                #
-                password = "p:" + up[1].replace("++", "+")
-            elif up[0].find("=") > -1:
-                up = up[0].split("=", 1)
-                user = up[0]
-                password = "k:" + up[1]
+            match = _UPHP.fullmatch(uphp)
+            if match:
+                user, password, host, port = match.group("user", "password", "host", "port")
+                if user is None:
+                    user = os.environ["USER"]
+                password = password.replace("++", "+") if password else ""
+                port = port or "22"
             else:
-                user = up[0]
-                password = "p:"
-            #
-            # Default port is 22.
-            #
-            hp = hp.split(":", 1) + ["22"]
-            #
-            # Convert any hostnames to canonical form, i.e. an address to
-            # make it possible to lookup passwords without ambiguity.
-            #
-            try:
-                host = socket.gethostbyname(hp[0])
-            except:
-                raise ValueError(_("Cannot find host address in '{}'").format(uphp)) from None
+                user, password, host, port = _split_uphp(uphp)
             try:
-                port = int(hp[1])
+                port = int(port)
             except ValueError:
                 raise ValueError(_("Expected numeric port in '{}'").format(uphp)) from None
-            uphps.append((user, password[2:], host, port))
+            entries.append((uphp, user, password, host, port))
+        #
+        # Convert any hostnames to canonical form, i.e. an address to
+        # make it possible to lookup passwords without ambiguity. The
+        # lookups are independent, so do them concurrently.
+        #
+        hosts = {entry[3] for entry in entries if not _is_address(entry[3])}
+        addresses = {}
+        if hosts:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(hosts)) as pool:
+                addresses = dict(zip(hosts, pool.map(_gethostbyname, hosts)))
+        uphps = []
+        for uphp, user, password, host, port in entries:
+            if host in addresses:
+                host = addresses[host]
+                if host is None:
+                    raise ValueError(_("Cannot find host address in '{}'").format(uphp))
+            uphps.append((user, password, host, port))
     except ValueError as e:
         raise ValueError(_("'{}' is not a valid list of uphps ({})").format(encoded_uphps, e)) from None
     return uphps
@@ -28,16 +28,16 @@ class NullTerminal(AbstractTerminal):
         super(NullTerminal, self).__init__("$SHELL", remote)
 
     def check_output(self, args, safe_msgs=()):
-        cmd = [self.program] + args
-        stdout = self.exec.check_output(cmd, lambda stdout, returncode: stdout.startswith(safe_msgs))
+        stdout = self.executor.check_output([self.program, *args],
+                                            lambda stdout, returncode: stdout.startswith(safe_msgs))
         return stdout.strip().split("\n") if stdout else []
 
     def list_sessions(self):
-        return []
+        return ()
 
     def new_session(self):
         try:
-            return self.exec.exec([self.program, "-i", "-l"], quote=False)
+            return self.executor.exec([self.program, "-i", "-l"], quote=False)
         except subprocess.CalledProcessError as e:
             if e.returncode == 127 and e.output.rfind("command not found") != -1:
                 #
@@ -16,7 +16,6 @@
 #
 """A screen(1) terminal."""
 import datetime
-import re
 import subprocess
 import gettext
 import logging
@@ -31,6 +30,45 @@ logger = logging.getLogger(__name__)
 # Keep PyCharm happy.
 _ = _
 
+#
+# Remove the flags which follow a window number in "screen -Q windows".
+#
+_WINDOW_FLAGS = str.maketrans("", "", "-$!@L&Z*")
+
+
+#
+# Capture a window in one command, "sh -c _CAPTURE sh screen session". The hardcopy goes to a new (and so empty)
+# temporary file, which avoids the append mode (in case it is in effect), and is deleted after use. "-X hardcopy" does
+# not wait for screen to finish, but the following "-Q info" does, and screen handles commands in order. The info line
+# comes first in the output, followed by the hardcopy.
+#
+_CAPTURE = 'n=$(mktemp) && "$1" -X -S "$2" hardcopy "$n" && info=$("$1" -X -S "$2" -Q info) && ' \
+           'printf "%s\\n" "$info" && cat "$n"; rc=$?; rm -f "$n"; exit $rc'
+
+
+def _parse_created(created):
+    """
+    Parse a session creation time, as shown by "screen -list".
+
+    :param created:         The time, in the "%d/%m/%y %H:%M:%S" format.
+    :return:                A datetime.
+    """
+    #
+    # Avoid the relative expense of strptime() for the usual fixed-width format, with %y's rule for the century.
+    #
+    try:
+        if len(created) == 17:
+            year = int(created[6:8])
+            year += 1900 if year >= 69 else 2000
+            return datetime.datetime(year, int(created[3:5]), int(created[0:2]),
+                                     int(created[9:11]), int(created[12:14]), int(created[15:17]))
+    except ValueError:
+        pass
+    #
+    # NOTE: the format is locale-dependent.
+    #
+    return datetime.datetime.strptime(created, "%d/%m/%y %H:%M:%S")
+
 
 class ScreenTerminal(AbstractTerminal):
     """
@@ -40,12 +78,14 @@ class ScreenTerminal(AbstractTerminal):
         super(ScreenTerminal, self).__init__("screen", remote)
 
     def check_output(self, args, safe_msgs=()):
-        cmd = [self.program] + args
-        stdout = self.exec.check_output(cmd,
-                                        lambda stdout, returncode: returncode == 1 and stdout.startswith(safe_msgs))
+        stdout = self.executor.check_output([self.program, *args],
+                                            lambda stdout, returncode: returncode == 1 and stdout.startswith(safe_msgs))
         return stdout.strip().split("\n") if stdout else []
 
     def list_sessions(self):
+        return self.cached(("list-sessions",), self._list_sessions, self.SESSIONS_TTL, self.SESSIONS_STALE_TTL)
+
+    def _list_sessions(self):
         try:
             safe_msgs = ("There is a screen on", "There are screens on")
             lines = self.check_output(["-list"], safe_msgs)
@@ -80,16 +120,14 @@ class ScreenTerminal(AbstractTerminal):
             except ValueError:
                 name, attached = line
                 created = "(01/01/70 00:00:00)"
-            #
-            # NOTE: the format is locale-dependent.
-            #
-            created = datetime.datetime.strptime(created[1:-1], "%d/%m/%y %H:%M:%S")
-            attached = 1 if attached[1:-1].lower() == "attached" else 0
+            created = _parse_created(created[1:-1])
+            attached = 1 if attached == "(Attached)" else 0
             sessions.append(ScreenSession(self, name, created, attached))
         logger.info(_("Found sessions {}").format([s["session_name"] for s in sessions]))
-        return sessions
+        return tuple(sessions)
 
     def new_session(self):
+        self.invalidate()
         try:
             return self.call([])
         except subprocess.CalledProcessError as e:
@@ -103,6 +141,8 @@ class ScreenTerminal(AbstractTerminal):
 
 
 class ScreenSession(AbstractSession):
+    __slots__ = ()
+
     def __init__(self, manager, name, created, attached):
         super(ScreenSession, self).__init__(manager)
         self[self.ID] = name
@@ -119,26 +159,26 @@ class ScreenSession(AbstractSession):
         return self.manager.check_output(["-X", "-S", self.id()] + args)
 
     def list_windows(self):
+        return self.manager.cached(("list-windows", self.id()), self._list_windows)
+
+    def _list_windows(self):
         #
         # $ screen -S 3345.hi -Q windows
         # 0$ bash  1$ bash  2-$ bash  3*$ bash
         #
         stdout = self.check_output(["-Q", "windows"])
         if not stdout:
-            return []
+            return ()
         stdout = stdout[0].split()
         assert len(stdout) % 2 == 0
-        windows = [(stdout[i], stdout[i + 1]) for i in range(0, len(stdout), 2)]
-        windows = [(re.sub("[-$!@L&Z]", "", w[0]), w[1]) for w in windows]
-        windows = [ScreenWindow(self.manager, w[0].replace("*", ""),
-                                w[1],
-                                1 if w[0][-1] == "*" else 0) for w in windows]
+        windows = [ScreenWindow(self.manager, index.translate(_WINDOW_FLAGS), name, 1 if "*" in index else 0)
+                   for index, name in zip(stdout[0::2], stdout[1::2])]
         #
         # If the window list is of length 1, ensure that the one window is marked active, since screen does not bother.
         #
         if len(windows) == 1:
             windows[0]["window_active"] = 1
-        return windows
+        return tuple(windows)
 
     def capture(self):
         #
@@ -155,35 +195,28 @@ class ScreenSession(AbstractSession):
         # Get the content of the active window.
         #
         try:
-            #
-            # Get the window dimensions.
-            #
-            # $ screen -X -S 21522.hello50 -Q info
-            # (37,45)/(143,45)+10000 +flow UTF-8 0(srhaque)
-            #
-            stdout = self.check_output(["-Q", "info"])
-            stdout = stdout[0].split("(")[2]
-            stdout = stdout.split(")")[0]
-            stdout = stdout.split(",")
-            w["window_width"] = int(stdout[0])
-            w["window_height"] = int(stdout[1]) + 1
-            #
-            # Create a temporary file and make sure it is deleted to avoid the append mode (in case it is in effect).
-            # Handle both local and remote cases.
-            #
-            name = self.manager.exec.check_output(["mktemp"]).strip()
-            self.manager.exec.check_output(["rm", "-f", name])
-            self.check_output(["hardcopy", name])
-            stdout = self.manager.exec.check_output(["cat", name])
-            self.manager.exec.check_output(["rm", name])
+            stdout = self.manager.executor.check_output(["sh", "-c", _CAPTURE, "sh", self.manager.program, self.id()])
         except subprocess.CalledProcessError:
             raise RuntimeError(_("Window capture failed"))
         #
+        # Get the window dimensions.
+        #
+        # $ screen -X -S 21522.hello50 -Q info
+        # (37,45)/(143,45)+10000 +flow UTF-8 0(srhaque)
+        #
+        info, stdout = stdout.split("\n", 1)
+        info = info.split("(")[2]
+        info = info.split(")")[0]
+        info = info.split(",")
+        w["window_width"] = int(info[0])
+        w["window_height"] = int(info[1]) + 1
+        #
         # Read the output.
         #
         s_lines = stdout.split("\n")[:-1]
         assert len(s_lines) + 1 == w["window_height"]
-        s_lines = [l.ljust(w["window_width"]) for l in s_lines]
+        pad = "{{:{}}}".format(w["window_width"]).format
+        s_lines = [pad(l) for l in s_lines]
         #
         # Add a line describing the windows in this session.
         #
@@ -194,6 +227,7 @@ class ScreenSession(AbstractSession):
         return s_lines, lhs, rhs
 
     def attach(self):
+        self.manager.invalidate()
         return self.manager.call(["-x", self.id()])
 
 
@@ -201,6 +235,8 @@ class ScreenWindow(AbstractWindow):
     """
     Model of a screen window, a subset of tmux's model.
     """
+    __slots__ = ()
+
     def __init__(self, manager, window_index, window_name, window_active):
         super(ScreenWindow, self).__init__(manager)
         self[self.ID] = window_name
@@ -214,4 +250,4 @@ class ScreenWindow(AbstractWindow):
         return self[self.ID]
 
     def list_panes(self):
-        return []
+        return ()
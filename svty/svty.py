@@ -19,6 +19,8 @@
 from __future__ import print_function
 
 import argparse
+import binascii
+import concurrent.futures
 import curses
 import curses.ascii
 import datetime
@@ -27,7 +29,6 @@ import gettext
 import inspect
 import json
 import logging
-import logging.handlers
 import os
 import setproctitle
 import shlex
@@ -36,10 +37,9 @@ import struct
 import subprocess
 import sys
 import termios
-import time
+import threading
 import tty
 
-from . import jumper
 from .abstract_terminal import AbstractSession, AbstractExecutor
 from .null_terminal import NullTerminal
 from .screen_terminal import ScreenTerminal
@@ -66,22 +66,50 @@ class CommandLineArgumentException(Exception):
 
 
 class Executor(AbstractExecutor):
+    """
+    How much remote output to ask for at a time. Captures can run to many KB, so this is big enough to take whatever
+    the jumper has buffered in one go.
+    """
+    READ_SIZE = 65536
+
     def __init__(self, args):
         super(Executor, self).__init__()
-        self.token = "HI"
-        self.stopping = False
+        #
+        # Marks the end of each remote command's output. It is random so that no real output can be mistaken for it,
+        # even when a read happens to end just after matching text.
+        #
+        self.token = binascii.hexlify(os.urandom(8)).decode()
+        self._token_suffix = (self.token + "\r\n").encode()
+        self._stopping = threading.Event()
         self.args = args
         self.jumper = None
         self.process = None
+        #
+        # There is only one remote shell, so only one conversation with it at a time.
+        #
+        self.lock = threading.Lock()
+        #
+        # Once exec() hands the remote shell to the user, queries can no longer use it.
+        #
+        self.handed_over = False
+        #
+        # Queries are run with a predictable timezone and locale.
+        #
+        self.env = dict(os.environ, TZ="UTC", LANG="en_GB.UTF-8")
         if self.args.uphps:
             #
             # Construct the SSH command. This is basically a loop that reads commands from stdin and eval's them. After
             # each command, the exit status and a token is printed to allow the results of the command execution to be
-            # unambiguously captured.
+            # unambiguously captured. The timezone and locale are set once, for every command.
             #
-            command = ["while", "IFS=", "read", "-r", "l", ";", "do", "eval", "$l", ";", "echo", "-e", "\"\\n$?\\n" +
+            command = ["export", "TZ=UTC", "LANG=en_GB.UTF-8", ";",
+                       "while", "IFS=", "read", "-r", "l", ";", "do", "eval", "$l", ";", "echo", "-e", "\"\\n$?\\n" +
                        self.token + "\"", ";", "done"]
             self.args.command = command
+            #
+            # The jumper is only needed for remote use.
+            #
+            from . import jumper
             self.jumper = jumper.run(self.args, follow_on=jumper.SSHMultiPass.FOLLOW_ON_PIO)
             self.start()
 
@@ -92,18 +120,23 @@ class Executor(AbstractExecutor):
                 args = [shlex.quote(a) for a in args]
             cmd = " ".join(args) + "\n"
             logger.debug(_("Remote exec '{}'").format(cmd[:-1]))
-            self.jumper.ping(cmd.encode())
-            stdout = b""
-            while len(stdout) < len(cmd) + 1:
-                time.sleep(0.05)
-                stdout += self.jumper.pong(1024)
-            assert cmd == stdout[:len(cmd) + 1].decode().replace("\r\n", "\n")
-            stdout = stdout[len(cmd) + 1:]
+            cmd = cmd.encode()
+            with self.lock:
+                self.handed_over = True
+                self.jumper.ping(cmd)
+                stdout = bytearray()
+                while len(stdout) < len(cmd) + 1:
+                    stdout.extend(self.jumper.pong(self.READ_SIZE))
+            #
+            # The TTY echoes the command, with CR-LF for the newline.
+            #
+            assert stdout[:len(cmd) + 1] == cmd[:-1] + b"\r\n"
+            del stdout[:len(cmd) + 1]
             os.write(sys.stdout.fileno(), stdout)
             #
             # TODO, what is the exit condition?
             #
-            self.jumper.follow_on(jumper.SSHMultiPass.FOLLOW_ON_HCI)
+            self.jumper.follow_on(self.jumper.FOLLOW_ON_HCI)
             self.jumper.wait()
             self.close()
         else:
@@ -122,38 +155,38 @@ class Executor(AbstractExecutor):
     def check_output(self, args, ignore_errors=None):
         returncode = None
         if self.args.uphps:
-            args = ["TZ=UTC", "LANG=en_GB.UTF-8"] + args
             cmd = [shlex.quote(a) for a in args]
             cmd = " ".join(cmd) + "\n"
             logger.debug(_("Remote check_output '{}'").format(cmd[:-1]))
-            self.jumper.ping(cmd.encode())
-            stdout = b""
-            while True:
-                time.sleep(0.05)
-                stdout += self.jumper.pong(1024)
-                if stdout[-len(self.token) - 2:].decode() == self.token + "\r\n":
-                    stdout = stdout.decode().replace("\r\n", "\n")
-                    stdout, returncode, t, t = stdout.rsplit("\n", 3)
-                    #
-                    # Jumping through intermediate hosts seems to introduce extraneous stuff.
-                    #
-                    stdout = stdout.lstrip()
-                    #
-                    # Remove the command string. TODO: for some reason, we sometimes get 1-2 copies of the command
-                    # on consecutive reads!!!
-                    #
-                    while stdout.startswith(cmd):
-                        stdout = stdout.split("\n", 1)[1]
-                    returncode = int(returncode)
-                    break
+            cmd = cmd.encode()
+            with self.lock:
+                if self.handed_over:
+                    raise RuntimeError(_("Remote shell handed over, cannot run '{}'").format(" ".join(args)))
+                self.jumper.ping(cmd)
+                stdout = bytearray()
+                while not stdout.endswith(self._token_suffix):
+                    stdout.extend(self.jumper.pong(self.READ_SIZE))
+            stdout = stdout.replace(b"\r\n", b"\n")
+            stdout, returncode, t, t = stdout.rsplit(b"\n", 3)
+            #
+            # Jumping through intermediate hosts seems to introduce extraneous stuff.
+            #
+            stdout = stdout.lstrip()
+            #
+            # Remove the command string. TODO: for some reason, we sometimes get 1-2 copies of the command
+            # on consecutive reads!!!
+            #
+            echoed = 0
+            while stdout.startswith(cmd, echoed):
+                echoed += len(cmd)
+            stdout = stdout[echoed:].decode()
+            returncode = int(returncode)
         else:
-            os.environ["TZ"] = "UTC"
-            os.environ["LANG"] = "en_GB.UTF-8"
             logger.debug(_("Local check_output '{}'").format(" ".join(args)))
-            self.process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                                            universal_newlines=True)
-            stdout, stderr = self.process.communicate()
-            returncode = self.process.returncode
+            process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=self.env)
+            stdout, stderr = process.communicate()
+            stdout = stdout.decode()
+            returncode = process.returncode
         logger.debug(_("Returning {} '{}'").format(returncode, stdout))
         #
         # Ignore certain errors...
@@ -167,14 +200,13 @@ class Executor(AbstractExecutor):
 
     def run(self):
         try:
-            while not self.stopping:
-                time.sleep(0.5)
+            self._stopping.wait()
         finally:
             logger.debug(_("Stopping {}").format(self))
 
     def close(self):
         logger.debug(_("Signalling stop for {}").format(self))
-        self.stopping = True
+        self._stopping.set()
         if self.args.uphps:
             self.jumper.close()
         else:
@@ -191,9 +223,70 @@ class HomeScreenLogHandler(logging.Handler):
         self.logs = self.logs[-50:]
 
 
-def show_sessions(stdscr, connections, log_handler):
+def collect_sessions(connections, pool=None):
+    """
+    List the sessions of all the connections. Each one typically runs a program, so query them concurrently.
+
+    :param connections:     The terminals to query.
+    :param pool:            A thread pool to reuse, rather than starting threads for every call.
+    :return:                A list of sessions.
+    """
+    if pool is None:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(connections)) as pool:
+            return collect_sessions(connections, pool)
+    futures = [pool.submit(connection.list_sessions) for connection in connections]
+    sessions = []
+    not_found = 0
+    for future in futures:
+        try:
+            sessions.extend(future.result())
+        except FileNotFoundError:
+            not_found += 1
+    if not_found == len(connections):
+        raise FileNotFoundError("Terminal program not found")
+    return sessions
+
+
+def _json_default(value):
+    """
+    Serialise the values json.dumps() cannot, i.e. timestamps.
+
+    :param value:           A value of one of the terminal models.
+    :return:                The value as a string.
+    """
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+
+#
+# The layout of a struct winsize, as used by TIOCGWINSZ.
+#
+_WINSIZE = struct.Struct("HHHH")
+
+
+def _sync_size():
+    """
+    Re-query the screen size, and make curses agree. Confusingly, this *causes* a curses.KEY_RESIZE!
+
+    :return:                The (lines, cols) available for a page, i.e. excluding the status line.
+    """
+    sizes = bytearray(_WINSIZE.size)
+    fcntl.ioctl(sys.stdin, termios.TIOCGWINSZ, sizes)
+    real_lines, real_cols, py, px = _WINSIZE.unpack(sizes)
+    if curses.is_term_resized(real_lines, real_cols):
+        logger.info(_("resizeterm to {}x{}").format(real_cols, real_lines))
+        curses.resizeterm(real_lines, real_cols)
+    if real_lines != curses.LINES or real_cols != curses.COLS:
+        logger.debug(_("update_lines_cols from {}x{} to {}x{}").format(curses.COLS, curses.LINES,
+                                                                       real_cols, real_lines))
+        curses.update_lines_cols()
+    return curses.LINES - 1, curses.COLS
+
+
+def show_sessions(stdscr, connections, log_handler, pool=None):
     """
     Return None, "", or a session.
+
+    :param pool:            A thread pool for querying the connections on each redraw.
     """
     #
     # Clear the screen.
@@ -204,31 +297,35 @@ def show_sessions(stdscr, connections, log_handler):
     STATUS = 2
     curses.init_pair(NORMAL, curses.COLOR_BLACK, curses.COLOR_WHITE)
     curses.init_pair(STATUS, curses.COLOR_BLACK, curses.COLOR_GREEN)
+    normal_attr = curses.color_pair(NORMAL)
+    status_attr = curses.color_pair(STATUS)
+    addstr = stdscr.addstr
     #
     # Start on the home session, page 0.
     #
     HOME_SESSION = 0
+    #
+    # How often the home page checks for new session lists, in ms, even without a key. The lists are refreshed in the
+    # background (see AbstractTerminal.refresh()), and the page is only redrawn once a refresh produces a result.
+    #
+    HOME_REFRESH = 1000
+    refreshes = None
     current_session = HOME_SESSION
     sessions = []
     session = None
     page_number = 0
+    #
+    # What is currently on the screen, to avoid rewriting unchanged lines.
+    #
+    drawn = []
+    drawn_status = None
+    drawn_size = None
+    #
+    # The debug view of each session, by session id.
+    #
+    debug_lines = {}
+    page_lines, page_cols = _sync_size()
     while True:
-        #
-        # Re-query the screen size. Confusingly, this *causes* a curses.KEY_RESIZE!
-        #
-        sizes = struct.pack('HHHH', 0, 0, 0, 0)
-        sizes = fcntl.ioctl(sys.stdin, termios.TIOCGWINSZ, sizes)
-        sizes = struct.unpack('HHHH', sizes)
-        real_lines, real_cols, py, px = sizes
-        if curses.is_term_resized(real_lines, real_cols):
-            logger.info(_("resizeterm to {}x{}").format(real_cols, real_lines))
-            curses.resizeterm(real_lines, real_cols)
-        if real_lines != curses.LINES or real_cols != curses.COLS:
-            logger.debug(_("update_lines_cols from {}x{} to {}x{}").format(curses.COLS, curses.LINES,
-                                                                           real_cols, real_lines))
-            curses.update_lines_cols()
-        page_lines = curses.LINES - 1
-        page_cols = curses.COLS
         if current_session == HOME_SESSION:
             if page_number > 0:
                 #
@@ -245,24 +342,17 @@ def show_sessions(stdscr, connections, log_handler):
                 #
                 # Re-query the number of sessions.
                 #
-                sessions = []
-                not_found = 0
-                for connection in connections:
-                    try:
-                        sessions.extend(connection.list_sessions())
-                    except FileNotFoundError:
-                        not_found += 1
-                if not_found == len(connections):
-                    raise FileNotFoundError("Terminal program not found")
+                refreshes = sum(connection.refreshes for connection in connections)
+                sessions = collect_sessions(connections, pool)
                 session = 0
-                lines = [_("{:8} {:19} {:8} {}").format(_("PROGRAM"), _("CREATED"), _("ATTACHED"), _("SESSION"))]
-                for s in sessions:
-                    line = _("{:8} {:19} {:8} {}").format(s.manager.program,
-                                                          s["session_created"].isoformat(),
-                                                          _("Yes") if s["session_attached"] else _("No"),
-                                                          s["session_name"])
-                    lines.append(line)
-                status = _("↵ to start new session, ←/→ then ↵ to attach to existing session, q to QUIT")
+                row = _("{:8} {:19} {:8} {}").format
+                yes = _("Yes")
+                no = _("No")
+                lines = [row(_("PROGRAM"), _("CREATED"), _("ATTACHED"), _("SESSION"))]
+                lines.extend([row(s.manager.program, s["session_created"].isoformat(),
+                                  yes if s["session_attached"] else no, s["session_name"]) for s in sessions])
+                status = _("↵ to start new session, ←/→ then ↵ to attach to existing session, r to refresh, "
+                           "q to QUIT")
         else:
             #
             # Display a session.
@@ -271,17 +361,21 @@ def show_sessions(stdscr, connections, log_handler):
             if page_number > 0:
                 #
                 # Debug mode: display tmux data.
+                # The rendering is reused until the windows change, are re-laid out, or see activity.
                 #
                 windows = session.list_windows()
-                for w in windows:
-                    panes = w.list_panes()
-                    w["window_panes"] = panes
-                session["session_windows"] = windows
-
-                def handler(x):
-                    return x.isoformat() if isinstance(x, datetime.datetime) else x
-
-                lines = json.dumps(session, indent=4, sort_keys=True, default=handler).split("\n")
+                fingerprint = tuple((w.id(), w.get("window_layout"), w.get("window_activity")) for w in windows)
+                try:
+                    cached_fingerprint, lines = debug_lines[session.id()]
+                except KeyError:
+                    cached_fingerprint = None
+                if cached_fingerprint != fingerprint:
+                    #
+                    # Serialise a copy: the session, windows and panes are shared with the cache.
+                    #
+                    tree = dict(session, session_windows=[dict(w, window_panes=w.list_panes()) for w in windows])
+                    lines = json.dumps(tree, indent=4, sort_keys=True, default=_json_default).split("\n")
+                    debug_lines[session.id()] = (fingerprint, lines)
                 pages = (len(lines) + page_lines - 1) // page_lines
                 page_number = min(pages, page_number)
                 lines = lines[(page_number - 1) * page_lines:]
@@ -309,25 +403,62 @@ def show_sessions(stdscr, connections, log_handler):
         #
         # Write a screenful of normal content. Start by making sure everything is trimmed and padded as needed.
         #
-        lines = lines[:page_lines]
-        lines.extend([""] * (page_lines - len(lines)))
-        lines = [l.ljust(page_cols)[:page_cols] for l in lines]
-        i = 0
+        pad = "{{:{0}.{0}}}".format(page_cols).format
+        lines = [pad(l) for l in lines[:page_lines]]
+        lines.extend([" " * page_cols] * (page_lines - len(lines)))
+        if drawn_size != (page_lines, page_cols):
+            drawn = [None] * page_lines
+            drawn_status = None
+            drawn_size = (page_lines, page_cols)
+        dirty = False
         for i, line in enumerate(lines):
-            stdscr.addstr(i, 0, line, curses.color_pair(NORMAL))
+            if line != drawn[i]:
+                addstr(i, 0, line, normal_attr)
+                dirty = True
+        drawn = lines
         #
         # The status line is truncated by one char because trying to emit that last char
         # conflicts with way ncurses handles the cursor after the write.
         #
-        stdscr.addstr(i + 1, 0, status.ljust(page_cols)[:page_cols - 1], curses.color_pair(STATUS))
-        stdscr.refresh()
+        status = pad(status)[:-1]
+        if status != drawn_status:
+            addstr(page_lines, 0, status, status_attr)
+            drawn_status = status
+            dirty = True
+        #
+        # Only push anything to the terminal if something changed.
+        #
+        if dirty:
+            stdscr.noutrefresh()
+            curses.doupdate()
         #
-        # Over to the user. Note that c can be outside the range that chr() understands.
+        # Over to the user. Note that c can be outside the range that chr() understands, and is -1 on timeout.
         #
-        c = stdscr.getch()
+        if current_session == HOME_SESSION and page_number == 0:
+            stdscr.timeout(HOME_REFRESH)
+        else:
+            stdscr.timeout(-1)
+        while True:
+            c = stdscr.getch()
+            if c != -1:
+                break
+            #
+            # Timed out on the home page. Start any refreshes which are due, without waiting for them, and only redraw
+            # once one has produced a result.
+            #
+            for connection in connections:
+                connection.refresh()
+            if sum(connection.refreshes for connection in connections) != refreshes:
+                break
         if c in [ord("q"), ord("Q")]:
             session = None
             break
+        elif c in [ord("r"), ord("R")]:
+            #
+            # Forget cached sessions, windows and panes, so the redraw queries them afresh.
+            #
+            for connection in connections:
+                connection.invalidate()
         elif c in [curses.ascii.CR, curses.ascii.LF, curses.KEY_ENTER]:
             if page_number == 0:
                 break
@@ -348,6 +479,14 @@ def show_sessions(stdscr, connections, log_handler):
         elif c == curses.KEY_PPAGE:
             if page_number:
                 page_number -= 1
+        elif c == curses.KEY_RESIZE:
+            page_lines, page_cols = _sync_size()
+    #
+    # The periodic redraws of the home page mean a background refresh is often in flight. Let it finish before the
+    # caller goes on to use the execution context for something else, such as attaching.
+    #
+    for connection in connections:
+        connection.wait_for_refreshes()
     if isinstance(session, AbstractSession):
         return session
     elif session == 0:
@@ -366,7 +505,8 @@ def run(args, log_handler):
         screen = ScreenTerminal(executor)
         null = NullTerminal(executor)
         connections = [tmux, screen, null]
-        session = curses.wrapper(show_sessions, connections, log_handler)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(connections)) as pool:
+            session = curses.wrapper(show_sessions, connections, log_handler, pool)
         if session is not None:
             if session == "":
                 #
@@ -437,7 +577,7 @@ Examples:
     parser.add_argument("-v", "--verbose", action="store_true", default=False,
                         help=_("Enable verbose output"))
     parser.add_argument("-d", "--debug", type=int, default=0,
-                        help=_("Enable remote debug"))
+                        help=_("Enable remote debug on the given port (needs the 'debug' extra)"))
     parser.add_argument("--proxy-options", default="-q -oStrictHostKeyChecking=no -oUserKnownHostsFile=/dev/null",
                         help=_("The proxy SSH options to use for the proxies and the outer SSH"))
     parser.add_argument("--outer-options", default="-tt",
@@ -457,6 +597,9 @@ Examples:
         #
         args = parser.parse_args(argv[1:])
         if args.debug != 0:
+            #
+            # pydevd is heavy, and only installed with the "debug" extra.
+            #
             import pydevd
             pydevd.settrace('localhost', port=args.debug, suspend=False)
             os.environ['TERM'] = 'xterm'
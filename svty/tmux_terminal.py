@@ -33,64 +33,168 @@ logger = logging.getLogger(__name__)
 _ = _
 
 
+def _control_blocks(stdout):
+    """
+    Split CONTROL MODE output into the output of each command. Each command's output is delimited by a "%begin" line,
+    and an "%end" or "%error" line with the same parameters.
+
+    :param stdout:          The output of "tmux -C".
+    :return:                A list of the output lines of each command.
+    """
+    blocks = []
+    lines = None
+    for line in stdout.split("\n"):
+        if lines is None:
+            if line.startswith("%begin "):
+                params = line[6:]
+                lines = []
+        elif line == "%end" + params or line == "%error" + params:
+            blocks.append(lines)
+            lines = None
+        else:
+            lines.append(line)
+    return blocks
+
+
+def _json_format(properties):
+    """
+    Build a tmux format which shows an item's properties as a JSON object.
+
+    :param properties:      The names of the properties.
+    :return:                The format, for "-F".
+    """
+    return "{" + ",".join(["\"{}\": \"#{{{}}}\"".format(p, p) for p in properties]) + "}"
+
+
 class TMuxTerminal(AbstractTerminal):
     """
     Support for tmux(1).
     """
     def __init__(self, remote):
         super(TMuxTerminal, self).__init__("tmux", remote)
+        #
+        # Until we learn otherwise, assume CONTROL MODE works, and so commands can be batched.
+        #
+        self.control_mode = True
 
     def check_output(self, args, safe_msgs=()):
+        return self.batch([args], safe_msgs)[0]
+
+    def batch(self, commands, safe_msgs=()):
+        """
+        Run a series of commands using a single invocation of tmux, to save round trips.
+
+        :param commands:        A list of commands, each a list of arguments.
+        :param safe_msgs:       Error messages which are not a problem.
+        :return:                A list of the output lines of each command.
+        """
+        if not commands:
+            #
+            # Without any command, tmux would run its default, and create a new session!
+            #
+            return []
+        if len(commands) > 1 and not self.control_mode:
+            return [self.check_output(command, safe_msgs) for command in commands]
+        args = []
+        for command in commands:
+            if args:
+                args.append(";")
+            args.extend(command)
         #
         # Ideally, we'd use "CONTROL MODE" which is supposed to delimit output nicely:
         #
-        # tmux -C list-sessions
+        # tmux -C list-sessions \; list-windows
         # %begin 1473880629 1 0
         # rtmux: 1 windows (created Wed Sep 14 18:20:00 2016) [143x43] (attached)
         # rtmux0: 1 windows (created Wed Sep 14 18:22:52 2016) [143x43] (attached)
         # %end 1473880629 1 0
-        #
-        cmd = [self.program, "-C"] + args
+        # %begin 1473880629 2 0
+        # 0: bash* (1 panes) [143x43] [layout c5be,143x43,0,0,0] @0 (active)
+        # %end 1473880629 2 0
+        # %exit
         #
         # Jumper does not separate stderr...
         #
-        stdout = self.exec.check_output(cmd,
-                                        lambda stdout, returncode: returncode == 1 and stdout.startswith(safe_msgs))
+        try:
+            stdout = self._run(["-C", *args], safe_msgs)
+        except subprocess.CalledProcessError as e:
+            blocks = _control_blocks(e.output) if e.output.startswith("%begin") else None
+            if blocks:
+                #
+                # Report the error from the failed command, much as it would be without CONTROL MODE.
+                #
+                e.output = "\n".join(blocks[-1]) + "\n"
+            raise
         if not stdout:
-            return []
+            return [[] for command in commands]
         #
         # Sadly, on tmux V1.8 at least, CONTROL MODE does not work
         #
         if stdout.startswith("%begin"):
-            return stdout.split("\n")[1:-2]
+            return _control_blocks(stdout)
+        elif stdout.startswith("%"):
+            #
+            # CONTROL MODE framing, but no output blocks: tmux sometimes replies with just "%exit" (e.g. when its stdin
+            # is already at EOF). CONTROL MODE still works in general, so just run this call without it.
+            #
+            logger.debug(_("Unexpected CONTROL MODE output {}, retrying without it").format(repr(stdout)))
+            return [self._run(command, safe_msgs).split("\n")[:-1] for command in commands]
+        elif len(commands) > 1:
+            logger.debug(_("No CONTROL MODE, not batching commands"))
+            self.control_mode = False
+            return [self.check_output(command, safe_msgs) for command in commands]
         else:
-            return stdout.split("\n")[:-1]
+            return [stdout.split("\n")[:-1]]
+
+    def _run(self, args, safe_msgs):
+        """
+        Run tmux once.
+
+        :param args:            The arguments to tmux.
+        :param safe_msgs:       Error messages which are not a problem.
+        :return:                The output of tmux.
+        """
+        return self.executor.check_output([self.program, *args],
+                                          lambda stdout, returncode: returncode == 1 and stdout.startswith(safe_msgs))
 
     def lister(self, query, clazz, safe_msgs=(), parent=None, sep=None):
-        formatter = ["\"{}\": \"#{{{}}}\"".format(p, p) for p in clazz.PROPERTIES]
-        formatter = "{" + ",".join(formatter) + "}"
         if parent:
-            lines = self.check_output([query, "-t", parent, "-F", formatter], safe_msgs)
+            lines = self.check_output([query, "-t", parent, "-F", clazz.FORMAT], safe_msgs)
         else:
-            lines = self.check_output([query, "-F", formatter], safe_msgs)
+            lines = self.check_output([query, "-F", clazz.FORMAT], safe_msgs)
+        #
+        # Each line is a JSON object: decode them all in one go as an array.
+        #
         items = []
-        for line in lines:
+        for line in json.loads("[" + ",".join(lines) + "]"):
             item = clazz(self)
-            line = json.loads(line)
             for k, v in line.items():
-                try:
-                    v = int(v)
-                    if k in clazz.TIMESTAMPS:
-                        v = datetime.datetime.fromtimestamp(v)
-                except ValueError:
+                #
+                # Unset properties are empty strings.
+                #
+                if k in clazz.STRINGS or not v:
                     if k == clazz.ID:
                         if parent:
                             v = parent + sep + v
+                else:
+                    try:
+                        v = int(v)
+                    except ValueError:
+                        #
+                        # Some tmux versions render some properties differently. Keep the text.
+                        #
+                        pass
+                    else:
+                        if k in clazz.TIMESTAMPS:
+                            v = datetime.datetime.fromtimestamp(v)
                 item[k] = v
             items.append(item)
-        return items
+        return tuple(items)
 
     def list_sessions(self):
+        return self.cached(("list-sessions",), self._list_sessions, self.SESSIONS_TTL, self.SESSIONS_STALE_TTL)
+
+    def _list_sessions(self):
         try:
             sessions = self.lister("list-sessions", TMuxSession)
         except subprocess.CalledProcessError as e:
@@ -102,13 +206,14 @@ class TMuxTerminal(AbstractTerminal):
                 raise FileNotFoundError(e.output.strip()) from None
             elif e.returncode == 1 and e.output.startswith(unsafe_msgs):
                 logger.debug(_("No session list: {}").format(e.output.strip()))
-                sessions = []
+                sessions = ()
             else:
                 raise
         logger.info(_("Found sessions {}").format([s["session_name"] for s in sessions]))
         return sessions
 
     def new_session(self):
+        self.invalidate()
         try:
             return self.call(["new-session"])
         except subprocess.CalledProcessError as e:
@@ -122,6 +227,8 @@ class TMuxTerminal(AbstractTerminal):
 
 
 class TMuxSession(AbstractSession):
+    __slots__ = ()
+
     PROPERTIES = [
         "session_attached",
         "session_activity",
@@ -136,12 +243,20 @@ class TMuxSession(AbstractSession):
         "session_width",
     ]
 
+    FORMAT = _json_format(PROPERTIES)
+
     TIMESTAMPS = [
         "session_activity",
         "session_created",
         "session_last_attached",
     ]
 
+    STRINGS = frozenset([
+        "session_group",
+        "session_id",
+        "session_name",
+    ])
+
     def __init__(self, manager):
         super(TMuxSession, self).__init__(manager)
 
@@ -154,7 +269,8 @@ class TMuxSession(AbstractSession):
         return self.manager.check_output(args + ["-t", self.id])
 
     def list_windows(self):
-        return self.manager.lister("list-windows", TMuxWindow, parent=self.id(), sep=":")
+        return self.manager.cached(("list-windows", self.id()),
+                                   lambda: self.manager.lister("list-windows", TMuxWindow, parent=self.id(), sep=":"))
 
     def capture(self):
         #
@@ -171,10 +287,14 @@ class TMuxSession(AbstractSession):
         # Get the content of the active window.
         #
         try:
-            s_lines = w.capture()
+            panes = w.list_panes()
+            s_lines = w.capture(panes)
         except subprocess.CalledProcessError as e:
+            #
+            # Perhaps the panes have changed since we listed them.
+            #
+            self.manager.invalidate()
             raise RuntimeError(_("Window capture failed"), e)
-        panes = w.list_panes()
         p = [p for p in panes if p["pane_active"]]
         assert len(p) <= 1, _("Expected up to 1 active pane, not {}").format(len(p))
         #
@@ -187,6 +307,7 @@ class TMuxSession(AbstractSession):
         return s_lines, lhs, rhs
 
     def attach(self):
+        self.manager.invalidate()
         return self.manager.call(["attach-session", "-t", self.id()])
 
 
@@ -194,6 +315,8 @@ class TMuxWindow(AbstractWindow):
     """
     Model of a tmux window
     """
+    __slots__ = ()
+
     PROPERTIES = [
         "window_activity",
         "window_active",
@@ -214,10 +337,21 @@ class TMuxWindow(AbstractWindow):
         "window_zoomed_flag",
     ]
 
+    FORMAT = _json_format(PROPERTIES)
+
     TIMESTAMPS = [
         "window_activity",
     ]
 
+    STRINGS = frozenset([
+        "window_find_matches",
+        "window_flags",
+        "window_id",
+        "window_layout",
+        "window_name",
+        "window_visible_layout",
+    ])
+
     def __init__(self, manager):
         super(TMuxWindow, self).__init__(manager)
 
@@ -233,6 +367,9 @@ class TMuxWindow(AbstractWindow):
         return self.manager.check_output(args + ["-t", self.id])
 
     def list_panes(self):
+        return self.manager.cached(("list-panes", self.id()), self._list_panes)
+
+    def _list_panes(self):
         panes = self.manager.lister("list-panes", TMuxPane, parent=self.id(), sep=".")
         #
         # Sadly, on tmux V1.8 at least, using pane_top and pane_left can be empty strings.
@@ -244,31 +381,54 @@ class TMuxWindow(AbstractWindow):
                 p["pane_left"] = 0
         return panes
 
-    def capture(self):
-        w_width = self["window_width"]
-        w_height = self["window_height"]
-        w_lines = []
-        for i in range(w_height):
-            w_lines.append(" " * w_width)
-        panes = self.list_panes()
-        for p in panes:
+    def capture(self, panes=None):
+        """
+        Screen capture.
+
+        :param panes:           The panes of the window, if the caller already has them.
+        :return:                List of lines representing the window.
+        """
+        if panes is None:
+            panes = self.list_panes()
+        #
+        # The window and pane lists are cached separately, so take the size from the panes to be sure of a consistent
+        # layout, e.g. just after a resize.
+        #
+        if panes:
+            w_width = max(p["pane_left"] + p["pane_width"] for p in panes)
+            w_height = max(p["pane_top"] + p["pane_height"] for p in panes)
+        else:
+            w_width = self["window_width"]
+            w_height = self["window_height"]
+        #
+        # Build each line as a list of characters, so that panes and joiners can be written in place rather than
+        # rebuilding the whole line each time.
+        #
+        w_lines = [[" "] * w_width for i in range(w_height)]
+        #
+        # Capture all the panes in one go.
+        #
+        captures = self.manager.batch([["capture-pane", "-p", "-t", p.simple_id()] for p in panes])
+        for p, p_lines in zip(panes, captures):
             p_top = p["pane_top"]
             p_left = p["pane_left"]
             p_width = p["pane_width"]
             p_height = p["pane_height"]
-            p_lines = p.capture()
-            p_lines = [l.ljust(p_width) for l in p_lines]
             #
-            # Add separators if the pane ends short of the window.
+            # Pad each line, and add separators if the pane ends short of the window.
             #
+            vr = "│" if p_left + p_width < w_width else ""
+            pad = ("{{:{0}.{0}}}".format(p_width) + vr).format
+            p_lines = [pad(l) for l in p_lines[:p_height]]
             if p_top + p_height < w_height:
-                p_lines.append("─" * p_width)
-            if p_left + p_width < w_width:
-                p_lines = [l + "│" for l in p_lines]
-            for y, p_line in enumerate(p_lines):
-                w_line = w_lines[p_top + y]
-                w_line = w_line[:p_left] + p_line + w_line[p_left + p_width + 1:]
-                w_lines[p_top + y] = w_line
+                p_lines.append("─" * p_width + vr)
+            for y, p_line in enumerate(p_lines, p_top):
+                w_lines[y][p_left:p_left + p_width + 1] = p_line
+        if len(panes) < 2:
+            #
+            # No separators, so no corners.
+            #
+            return ["".join(w_line) for w_line in w_lines]
         #
         # Merge separators at corners using ┤ ├ ┴ ┬ ┼.
         #
@@ -296,7 +456,7 @@ class TMuxWindow(AbstractWindow):
                                 joiner = "├"
                         else:
                             joiner = "┬"
-                        w_lines[hr_y] = w_line[:vr_x] + joiner + w_line[vr_x + 1:]
+                        w_line[vr_x] = joiner
                 if p_left + p_width < w_width:
                     w_line = w_lines[hr_y]
                     vr_x = p_left + p_width
@@ -311,7 +471,7 @@ class TMuxWindow(AbstractWindow):
                                 joiner = "┤"
                         else:
                             joiner = "┬"
-                        w_lines[hr_y] = w_line[:vr_x] + joiner + w_line[vr_x + 1:]
+                        w_line[vr_x] = joiner
             if p_top + p_height < w_height:
                 #
                 # There is a <hr> below us.
@@ -331,7 +491,7 @@ class TMuxWindow(AbstractWindow):
                                 joiner = "├"
                         else:
                             joiner = "┴"
-                        w_lines[hr_y] = w_line[:vr_x] + joiner + w_line[vr_x + 1:]
+                        w_line[vr_x] = joiner
                 if p_left + p_width < w_width:
                     w_line = w_lines[hr_y]
                     vr_x = p_left + p_width
@@ -346,14 +506,16 @@ class TMuxWindow(AbstractWindow):
                                 joiner = "┤"
                         else:
                             joiner = "┴"
-                        w_lines[hr_y] = w_line[:vr_x] + joiner + w_line[vr_x + 1:]
-        return w_lines
+                        w_line[vr_x] = joiner
+        return ["".join(w_line) for w_line in w_lines]
 
 
 class TMuxPane(dict):
     """
     Model of a tmux pane.
     """
+    __slots__ = ("manager",)
+
     PROPERTIES = [
         "pane_active",
         "pane_bottom",
@@ -378,9 +540,21 @@ class TMuxPane(dict):
         "pane_width",
     ]
 
+    FORMAT = _json_format(PROPERTIES)
+
     TIMESTAMPS = [
     ]
 
+    STRINGS = frozenset([
+        "pane_current_command",
+        "pane_current_path",
+        "pane_id",
+        "pane_start_command",
+        "pane_tabs",
+        "pane_title",
+        "pane_tty",
+    ])
+
     def __init__(self, manager):
         super(TMuxPane, self).__init__()
         self.manager = manager
@@ -390,6 +564,12 @@ class TMuxPane(dict):
     def id(self):
         return self[self.ID]
 
+    def simple_id(self):
+        """
+        Pane ids are unique across the server, so the id can be used without the window id which qualifies it.
+        """
+        return self.id().split(".")[-1]
+
     def check_output(self, args):
         """
         Run a command on the pane.
@@ -401,7 +581,7 @@ class TMuxPane(dict):
                 #
                 # Sadly, on tmux V1.8 at least, using the fully-qualified id does not work
                 #
-                simple_id = self.id().split(".")[-1]
+                simple_id = self.simple_id()
                 logger.debug(_("Retrying with id {} instead of {}").format(simple_id, self.id()))
                 return self.manager.check_output(args + ["-t", simple_id])
             else:
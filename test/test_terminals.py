@@ -16,10 +16,12 @@
 #
 """nosetest suite for svty's tmux support."""
 import argparse
+import datetime
 import threading
 import time
 
 from svty import abstract_terminal
+from svty import null_terminal
 from svty import screen_terminal
 from svty import tmux_terminal
 from svty import svty
@@ -61,3 +63,122 @@ def test_002():
     TEST: check screen new_session.
     """
     new_session(screen_terminal.ScreenTerminal)
+
+
+def test_003():
+    """
+    TEST: check query results are reused until they expire or are invalidated.
+    """
+    terminal = null_terminal.NullTerminal(None)
+    queries = []
+
+    def query():
+        queries.append(None)
+        return len(queries)
+
+    assert terminal.cached(("query",), query) == 1
+    assert terminal.cached(("query",), query) == 1
+    assert terminal.cached(("query",), query, ttl=0) == 2
+    terminal.invalidate()
+    assert terminal.cached(("query",), query) == 3
+
+
+def test_004():
+    """
+    TEST: check screen session creation times are parsed like strptime() does.
+    """
+    for created in ["16/09/16 08:35:16", "01/01/70 00:00:00", "31/12/68 23:59:59", "1/2/16 08:35:16"]:
+        assert screen_terminal._parse_created(created) == datetime.datetime.strptime(created, "%d/%m/%y %H:%M:%S")
+
+
+def test_005():
+    """
+    TEST: check an expired query result is still returned while it is refreshed in the background.
+    """
+    terminal = null_terminal.NullTerminal(None)
+    refreshed = threading.Event()
+    queries = []
+
+    def query():
+        queries.append(None)
+        if len(queries) > 1:
+            refreshed.set()
+        return len(queries)
+
+    assert terminal.cached(("query",), query) == 1
+    assert terminal.cached(("query",), query, ttl=0, stale_ttl=60) == 1
+    assert refreshed.wait(5)
+    terminal.wait_for_refreshes()
+    assert terminal.cached(("query",), query) == 2
+    #
+    # Invalidation waits for a refresh in progress, and does not let it restore its result.
+    #
+    finished = threading.Event()
+
+    def slow_query():
+        time.sleep(0.2)
+        finished.set()
+        return 0
+
+    assert terminal.cached(("query",), slow_query, ttl=0, stale_ttl=60) == 2
+    terminal.invalidate()
+    assert finished.is_set()
+    assert terminal.cached(("query",), query) == 3
+
+
+class ScriptedExecutor(object):
+    """
+    Reply to each command with the next of a series of outputs.
+    """
+    def __init__(self, outputs):
+        self.outputs = list(outputs)
+        self.commands = []
+
+    def check_output(self, args, ignore_errors=None):
+        self.commands.append(args)
+        return self.outputs.pop(0)
+
+
+def test_006():
+    """
+    TEST: check a bare "%exit" from tmux CONTROL MODE is retried without it, and does not stop batching.
+    """
+    executor = ScriptedExecutor(["%exit\n", "a\n", "b\nc\n"])
+    terminal = tmux_terminal.TMuxTerminal(executor)
+    assert terminal.batch([["one"], ["two"]]) == [["a"], ["b", "c"]]
+    assert terminal.control_mode
+    assert executor.commands == [["tmux", "-C", "one", ";", "two"], ["tmux", "one"], ["tmux", "two"]]
+    assert terminal.batch([]) == []
+
+
+def test_007():
+    """
+    TEST: check a missing terminal program is remembered like a result, and refreshed in the background.
+    """
+    terminal = null_terminal.NullTerminal(None)
+    queries = []
+
+    def query():
+        queries.append(None)
+        raise FileNotFoundError("missing")
+
+    for i in range(2):
+        try:
+            terminal.cached(("query",), query, ttl=60)
+            assert False
+        except FileNotFoundError:
+            pass
+    assert len(queries) == 1
+    #
+    # Once expired, the error is still raised, while refresh() reruns the query in the background.
+    #
+    try:
+        terminal.cached(("query",), query, ttl=0, stale_ttl=60)
+        assert False
+    except FileNotFoundError:
+        pass
+    terminal.wait_for_refreshes()
+    terminal.refresh()
+    terminal.wait_for_refreshes()
+    assert len(queries) == 3
+    assert terminal.refreshes == 2